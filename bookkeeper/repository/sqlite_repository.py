@@ -2,14 +2,15 @@
 SQlite3 repository implementation
 """
 
-from typing import Any, cast
+from typing import Any, Callable, Iterator, Sequence, cast
 from inspect import get_annotations
+from dataclasses import fields, is_dataclass
 from pathlib import Path
+from queue import Empty, Queue
+from contextlib import contextmanager, suppress
+import threading
 import sqlite3
-from datetime import datetime
-
-# from datetime import datetime
-from contextlib import closing
+from datetime import datetime, timedelta
 
 from bookkeeper.repository.abstract_repository import (
     AbstractRepository,
@@ -17,13 +18,198 @@ from bookkeeper.repository.abstract_repository import (
     PK_FIELD_NAME,
 )
 
+# datetimes are stored as wall-clock microseconds since the epoch
+_DATETIME_EPOCH = datetime(1970, 1, 1)
+_DATETIME_UNIT = timedelta(microseconds=1)
+# format of datetimes written by earlier versions of the repository
+_LEGACY_DATETIME_FMT = "%d/%m/%y %H:%M:%S.%f"
+
+
+def _adapt_datetime(val: datetime) -> int:
+    return (val.replace(tzinfo=None) - _DATETIME_EPOCH) // _DATETIME_UNIT
+
+
+def _convert_datetime(val: bytes) -> datetime:
+    try:
+        return _DATETIME_EPOCH + timedelta(microseconds=int(val))
+    except ValueError:
+        return datetime.strptime(val.decode(), _LEGACY_DATETIME_FMT)
+
 
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("DATETIME", _convert_datetime)
+
+
+# pylint: disable-next=too-many-instance-attributes
+class _ConnectionPool:
+    """
+    Bounded pool of connections to a single database file.
+    Connections are opened lazily on checkout, `setup` is called once
+    for every new connection.
+    Use `shared` to get the pool common to all users of a database file.
+    """
+
+    _registry: dict[str, "_ConnectionPool"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(
+        self,
+        db_filename: Path | str,
+        size: int,
+        setup: Callable[[sqlite3.Connection], None],
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"Connection pool size must be positive, got {size}")
+        if str(db_filename) == ":memory:":
+            # every connection to :memory: opens its own database
+            size = 1
+        self._db_filename = db_filename
+        self._size = size
+        self._setup = setup
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._idle: Queue[sqlite3.Connection] = Queue(maxsize=size)
+        # connection currently checked out by each thread and nesting depth
+        self._held = threading.local()
+        self._key: str | None = None
+        self._users = 1
+
+    @classmethod
+    def shared(
+        cls,
+        db_filename: Path | str,
+        size: int,
+        setup: Callable[[sqlite3.Connection], None],
+    ) -> "_ConnectionPool":
+        """
+        Get the pool of the database file, creating it on first use,
+        `size` and `setup` of the first user are applied.
+        ':memory:' databases are private, so they always get a new pool.
+        Every call must be paired with `release`.
+        """
+        if size < 1:
+            raise ValueError(f"Connection pool size must be positive, got {size}")
+        if str(db_filename) == ":memory:":
+            return cls(db_filename, size, setup)
+
+        key = str(Path(db_filename).resolve())
+        with cls._registry_lock:
+            pool = cls._registry.get(key)
+            if pool is None:
+                pool = cls(db_filename, size, setup)
+                pool._key = key
+                cls._registry[key] = pool
+            else:
+                pool._users += 1
+        return pool
+
+    def release(self) -> None:
+        """
+        Drop one user of the pool, the pool is closed after the last one
+        """
+        with self._registry_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            if self._key is not None:
+                del self._registry[self._key]
+        self.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(
+            self._db_filename,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._setup(con)
+        return con
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self._size
+            if can_open:
+                self._opened += 1
+
+        if not can_open:
+            return self._idle.get()
+
+        try:
+            return self._connect()
+        except BaseException:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    @contextmanager
+    def checkout(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection from the pool, blocks if all of them are in use.
+        Nested checkouts in the same thread reuse the connection it already
+        holds, so a thread never waits for itself.
+        """
+        con: sqlite3.Connection | None = getattr(self._held, "con", None)
+        if con is None:
+            con = self._acquire()
+            self._held.con = con
+            self._held.depth = 0
+
+        self._held.depth += 1
+        try:
+            yield con
+        finally:
+            self._held.depth -= 1
+            if self._held.depth == 0:
+                self._held.con = None
+                self._put_back(con)
+
+    def _put_back(self, con: sqlite3.Connection) -> None:
+        if con.in_transaction:
+            # never hand out a connection with a transaction left open
+            try:
+                con.execute("ROLLBACK")
+            except sqlite3.Error:
+                con.close()
+                with self._lock:
+                    self._opened -= 1
+                return
+        self._idle.put(con)
+
+    def close(self) -> None:
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except Empty:
+                    break
+                self._opened -= 1
+
+
+# pylint: disable-next=too-many-instance-attributes
 class SqliteRepository(AbstractRepository[T]):
     """
-    SqliteRepository class, stores models in a database
+    SqliteRepository class, stores models in a database.
+    Repositories of the same database file share one connection pool,
+    its size is set by `pool_size` of the first repository opened on the file.
     """
 
-    def __init__(self, db_filename: Path, cls: type) -> None:
+    def __init__(
+        self,
+        db_filename: Path,
+        cls: type,
+        pool_size: int = 5,
+        indexed_fields: list[str] | None = None,
+    ) -> None:
+        if pool_size < 1:
+            raise ValueError(f"Connection pool size must be positive, got {pool_size}")
         self._db_name = db_filename
         self._cls = cls
         self._table_name = cls.__name__.lower()
@@ -31,12 +217,61 @@ class SqliteRepository(AbstractRepository[T]):
         if len(self._fields) == 0:
             raise TypeError("Trying to create repository without annotated fields")
         self._fields.pop(PK_FIELD_NAME)
-
-        self._init_database()
+        self._field_names = tuple(self._fields)
+        self._where_cache: dict[frozenset[str], tuple[str, tuple[str, ...]]] = {}
+        self._indexed_fields = tuple(indexed_fields or ())
+        for name in self._indexed_fields:
+            if name not in self._fields:
+                raise ValueError(f"Trying to index unexpected field: {name}")
+
+        self._columns = (PK_FIELD_NAME, *self._field_names)
+        self._construct: Callable[[Sequence[Any]], T] = self._construct_by_setattr
+        if is_dataclass(cls):
+            init_names = {field.name for field in fields(cls) if field.init}
+            if init_names == set(self._columns):
+                self._construct = self._construct_dataclass
+
+        names = ", ".join(self._field_names)
+        placeholders = ", ".join("?" * len(self._field_names))
+        self._sql_insert = (
+            f"INSERT INTO {self._table_name} ({names}) VALUES ({placeholders})"
+        )
+        self._sql_select = f"SELECT {', '.join(self._columns)} FROM {self._table_name}"
+        self._sql_get = f"{self._sql_select} WHERE {PK_FIELD_NAME} = ?"
+        assignments = ", ".join(f"{name} = ?" for name in self._field_names)
+        self._sql_update = (
+            f"UPDATE {self._table_name} SET {assignments} WHERE {PK_FIELD_NAME} = ?"
+        )
+        self._sql_delete = f"DELETE FROM {self._table_name} WHERE {PK_FIELD_NAME} = ?"
+
+        self._pool = _ConnectionPool.shared(self._db_name, pool_size, self._set_pragmas)
+
+        try:
+            self._init_database()
+        except BaseException:
+            self._pool.release()
+            raise
+
+    _pragmas: tuple[str, ...] = (
+        "journal_mode = WAL",
+        "synchronous = NORMAL",
+        "cache_size = -64000",
+        "temp_store = MEMORY",
+        "mmap_size = 268435456",
+        "foreign_keys = ON",
+    )
 
     @staticmethod
-    def _set_pragmas(cursor: sqlite3.Cursor) -> None:
-        cursor.execute("PRAGMA foreign_keys = ON")
+    def _set_pragmas(con: sqlite3.Connection) -> None:
+        for pragma in SqliteRepository._pragmas:
+            con.execute(f"PRAGMA {pragma}")
+
+    def close(self) -> None:
+        """
+        Release the database connections, they are closed
+        once no repository of the same database file uses them
+        """
+        self._pool.release()
 
     _type_mappings: dict[type, str] = {
         str: "TEXT",
@@ -45,8 +280,6 @@ class SqliteRepository(AbstractRepository[T]):
         datetime: "DATETIME",
     }
 
-    _datetime_fmt = "%d/%m/%y %H:%M:%S.%f"
-
     @staticmethod
     def _map_to_sql(tpy: type) -> str:
         res = SqliteRepository._type_mappings.get(tpy, None)
@@ -54,38 +287,89 @@ class SqliteRepository(AbstractRepository[T]):
             raise ValueError(f"Type {tpy} is not supported yet")
         return res
 
-    @staticmethod
-    def _make_val_from_sql(tpy: type, val: Any) -> Any:
-        if tpy is datetime:
-            return datetime.strptime(val, SqliteRepository._datetime_fmt)
-        return val
-
-    @staticmethod
-    def _val_to_sql(val: Any) -> Any:
-        if isinstance(val, datetime):
-            return val.strftime(SqliteRepository._datetime_fmt)
-
-        return val
-
     def _init_database(self) -> None:
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
-            cursor.execute(
-                f"CREATE TABLE IF NOT EXISTS {self._table_name}"
-                + f"({PK_FIELD_NAME} INTEGER PRIMARY KEY NOT NULL, "
-                + ", ".join(
-                    f"{name} {self._map_to_sql(tpy)}"
-                    for name, tpy in self._fields.items()
+        ddl = [
+            f"CREATE TABLE IF NOT EXISTS {self._table_name}"
+            + f"({PK_FIELD_NAME} INTEGER PRIMARY KEY NOT NULL, "
+            + ", ".join(
+                f"{name} {self._map_to_sql(tpy)}" for name, tpy in self._fields.items()
+            )
+            + ")",
+            *(
+                f"CREATE INDEX IF NOT EXISTS idx_{self._table_name}_{name} "
+                f"ON {self._table_name} ({name})"
+                for name in self._indexed_fields
+            ),
+        ]
+
+        with self._pool.checkout() as con:
+            # not executescript, it would commit a transaction the thread holds
+            for statement in ddl:
+                con.execute(statement)
+            columns = {
+                name: decl_type.upper()
+                for _, name, decl_type, *_ in con.execute(
+                    f"PRAGMA table_info({self._table_name})"
                 )
-                + ")"
+            }
+
+        expected = {PK_FIELD_NAME: "INTEGER"} | {
+            name: self._map_to_sql(tpy) for name, tpy in self._fields.items()
+        }
+        found = {name: columns.get(name) for name in expected}
+        if found != expected:
+            raise TypeError(
+                f"Incompatible table `{self._table_name}` schema: "
+                f"got {found}, expected {expected}"
             )
 
     def _decompose(self, obj: T) -> list[Any]:
-        return [self._val_to_sql(getattr(obj, key)) for key in self._fields]
+        return [getattr(obj, key) for key in self._field_names]
 
-    def add(self, obj: T) -> int:
+    @staticmethod
+    @contextmanager
+    def _transaction(con: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        if con.in_transaction:
+            # nested block, make it undoable on its own
+            con.execute("SAVEPOINT nested")
+            try:
+                yield con
+            except BaseException:
+                with suppress(sqlite3.Error):
+                    con.execute("ROLLBACK TO nested")
+                    con.execute("RELEASE nested")
+                raise
+            con.execute("RELEASE nested")
+            return
+
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+            con.execute("COMMIT")
+        except BaseException:
+            # a failed COMMIT may leave the transaction open, the original
+            # error is kept if rolling back fails, the pool will not reuse
+            # a connection left inside a transaction
+            with suppress(sqlite3.Error):
+                con.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Run all operations of the current thread inside the block within
+        a single transaction. This covers every repository of the same
+        database file, as they share the connection pool and a thread reuses
+        the connection it holds. Changes are committed on exit and rolled back
+        if an exception is raised. Nested blocks run within a savepoint
+        of the outer transaction, so an exception escaping a nested block
+        only undoes that block.
+        """
+        with self._pool.checkout() as con, self._transaction(con):
+            yield
+
+    @staticmethod
+    def _check_addable(obj: T) -> None:
         if (prim_key := getattr(obj, PK_FIELD_NAME, None)) is None:
             raise ValueError(
                 f"Trying to add object without `{PK_FIELD_NAME}` attribute"
@@ -95,113 +379,196 @@ class SqliteRepository(AbstractRepository[T]):
                 f"Trying to add object with filled `{PK_FIELD_NAME}` attribute"
             )
 
-        names = ", ".join(self._fields)
-        placeholders = ", ".join("?" * len(self._fields))
+    def add(self, obj: T) -> int:
+        self._check_addable(obj)
 
         values = self._decompose(obj)
 
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
-            cursor.execute(
-                f"INSERT INTO {self._table_name} ({names}) VALUES ({placeholders})",
-                values,
-            )
+        with self._pool.checkout() as con:
+            cursor = con.execute(self._sql_insert, values)
 
-            assert cursor.lastrowid is not None
-            obj.primary_key = cursor.lastrowid
+        assert cursor.lastrowid is not None
+        obj.primary_key = cursor.lastrowid
 
         return obj.primary_key
 
-    def _make_obj(
-        self, primary_key: int, names: tuple[Any, ...], vals: tuple[Any, ...]
-    ) -> T:
-        obj = self._cls()
-        setattr(obj, PK_FIELD_NAME, primary_key)
-
-        for col_desc, val in zip(names, vals, strict=True):
-            if col_desc[0] not in self._fields:
-                raise ValueError(f"Unexpected field name: {col_desc[0]}")
-            exp_type = self._fields[col_desc[0]]
-            mapped_val = self._make_val_from_sql(exp_type, val)
-            if not isinstance(mapped_val, exp_type):
-                raise TypeError(
-                    f"Incompatible types: got {type(mapped_val)}, expected {exp_type}"
-                )
-            setattr(obj, col_desc[0], mapped_val)
+    def add_many(self, objs: list[T]) -> list[int]:
+        """
+        Add several objects within a single transaction, return their ids,
+        also write ids to `primary_key` attribute of every object.
+        """
+        for obj in objs:
+            self._check_addable(obj)
+        if not objs:
+            return []
+
+        with self._pool.checkout() as con, self._transaction(con):
+            con.executemany(self._sql_insert, [self._decompose(obj) for obj in objs])
+            # rows are inserted under a write lock, so their ids are consecutive
+            (last_key,) = con.execute("SELECT last_insert_rowid()").fetchone()
+
+        primary_keys = list(range(last_key - len(objs) + 1, last_key + 1))
+        for obj, primary_key in zip(objs, primary_keys):
+            obj.primary_key = primary_key
 
+        return primary_keys
+
+    def _construct_dataclass(self, row: Sequence[Any]) -> T:
+        return cast(T, self._cls(**dict(zip(self._columns, row))))
+
+    def _construct_by_setattr(self, row: Sequence[Any]) -> T:
+        obj = self._cls()
+        for name, val in zip(self._columns, row):
+            setattr(obj, name, val)
         return cast(T, obj)
 
+    def _row_factory(self, _cursor: sqlite3.Cursor, row: tuple[Any, ...]) -> T:
+        """
+        Make object from a row selected with `_sql_select`,
+        which always lists columns in `_columns` order
+        """
+        return self._construct(row)
+
+    def _select(
+        self, con: sqlite3.Connection, query: str, params: Sequence[Any] = ()
+    ) -> sqlite3.Cursor:
+        cursor = con.cursor()
+        cursor.row_factory = self._row_factory
+        return cursor.execute(query, params)
+
     def get(self, primary_key: int) -> T | None:
-        names = ", ".join(self._fields)
+        with self._pool.checkout() as con:
+            obj = self._select(con, self._sql_get, (primary_key,)).fetchone()
 
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
-            data = cursor.execute(
-                f"SELECT {names} FROM {self._table_name} "
-                f"WHERE {PK_FIELD_NAME} = {primary_key}"
-            ).fetchone()
+        return cast(T | None, obj)
 
-            if data is None:
-                return None
-            names_desc = cursor.description
+    # lowest SQLITE_MAX_VARIABLE_NUMBER among supported sqlite versions
+    _max_variables = 999
 
-        return self._make_obj(primary_key, names_desc, data)
+    @staticmethod
+    def _key_chunks(primary_keys: Sequence[int]) -> Iterator[Sequence[int]]:
+        step = SqliteRepository._max_variables
+        for start in range(0, len(primary_keys), step):
+            end = start + step
+            yield primary_keys[start:end]
+
+    def get_many(self, primary_keys: Sequence[int]) -> list[T]:
+        """
+        Get objects by several ids in one query per up to 999 ids.
+        Objects are returned in the order of first occurrence of their ids
+        in `primary_keys`, repeated ids give a single object,
+        ids which do not exist are skipped.
+        """
+        unique_keys = list(dict.fromkeys(primary_keys))
+        found: dict[int, T] = {}
+        with self._pool.checkout() as con:
+            for chunk in self._key_chunks(unique_keys):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = self._select(
+                    con,
+                    f"{self._sql_select} WHERE {PK_FIELD_NAME} IN ({placeholders})",
+                    chunk,
+                )
+                found.update((obj.primary_key, obj) for obj in cursor)
+
+        return [found[key] for key in unique_keys if key in found]
+
+    def _where_clause(self, names: frozenset[str]) -> tuple[str, tuple[str, ...]]:
+        if (cached := self._where_cache.get(names)) is not None:
+            return cached
+
+        for name in names:
+            if name != PK_FIELD_NAME and name not in self._fields:
+                raise ValueError(f"Unexpected field name: {name}")
+        order = tuple(names)
+        clause = f" WHERE {' AND '.join(f'{name} = ?' for name in order)}"
+        return self._where_cache.setdefault(names, (clause, order))
+
+    def _where_query(
+        self, query: str, where: dict[str, Any] | None
+    ) -> tuple[str, list[Any]]:
+        if not where:
+            return query, []
+        clause, order = self._where_clause(frozenset(where))
+        return query + clause, [where[name] for name in order]
+
+    _fetch_size = 1000
+
+    def iter_all(self, where: dict[str, Any] | None = None) -> Iterator[T]:
+        """
+        Iterate over all records matching the condition, same as `get_all`,
+        but rows are fetched lazily in batches.
+        A pool connection is held until the iterator is exhausted or closed,
+        other calls from the same thread meanwhile reuse it.
+        """
+        query, params = self._where_query(self._sql_select, where)
+        return self._iter_select(query, params)
+
+    def _iter_select(self, query: str, params: Sequence[Any]) -> Iterator[T]:
+        with self._pool.checkout() as con:
+            cursor = self._select(con, query, params)
+            while objs := cursor.fetchmany(self._fetch_size):
+                yield from objs
 
     def get_all(self, where: dict[str, Any] | None = None) -> list[T]:
-        names = ", ".join(self._fields)
-        query = f"SELECT {PK_FIELD_NAME}, {names} FROM {self._table_name}"
-        params: list[Any] = []
-        if where is not None:
-            query += f" WHERE {' AND '.join(map(lambda name: f'{name} = ?', where))}"
-            params.extend(where[name] for name in where)
-
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
-            data_lst = cursor.execute(query, params).fetchall()
-            names_desc = cursor.description
-
-        return [self._make_obj(data[0], names_desc[1:], data[1:]) for data in data_lst]
+        query, params = self._where_query(self._sql_select, where)
 
-    def update(self, obj: T) -> None:
-        names = ", ".join(self._fields)
-        placeholders = ", ".join("?" * len(self._fields))
+        with self._pool.checkout() as con:
+            return list(self._select(con, query, params))
+
+    def get_column(self, name: str, where: dict[str, Any] | None = None) -> list[Any]:
+        """
+        Get values of a single field of all records matching the condition,
+        without building the objects themselves
+        """
+        if name != PK_FIELD_NAME and name not in self._fields:
+            raise ValueError(f"Unexpected field name: {name}")
 
+        query, params = self._where_query(
+            f"SELECT {name} FROM {self._table_name}", where
+        )
+
+        with self._pool.checkout() as con:
+            return [row[0] for row in con.execute(query, params)]
+
+    def update(self, obj: T) -> None:
         primary_key = getattr(obj, PK_FIELD_NAME)
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
-            cursor.execute(
-                f"UPDATE {self._table_name} "
-                f"SET ({names}) = ({placeholders}) "
-                f"WHERE {PK_FIELD_NAME}={primary_key}",
-                self._decompose(obj),
+        with self._pool.checkout() as con:
+            cursor = con.execute(self._sql_update, [*self._decompose(obj), primary_key])
+
+        if cursor.rowcount == 0:
+            raise ValueError(
+                f"Trying to update object with key {primary_key}, "
+                "which does not exist"
             )
 
-            if con.total_changes == 0:
-                raise ValueError(
-                    f"Trying to update object with key {primary_key}, "
-                    "which does not exist"
+    def delete_many(self, primary_keys: Sequence[int]) -> None:
+        """
+        Delete objects by several ids within a single transaction.
+        Nothing is deleted if any of the objects does not exist.
+        """
+        unique_keys = list(dict.fromkeys(primary_keys))
+        with self._pool.checkout() as con, self._transaction(con):
+            deleted = 0
+            for chunk in self._key_chunks(unique_keys):
+                placeholders = ", ".join("?" * len(chunk))
+                deleted += con.execute(
+                    f"DELETE FROM {self._table_name} "
+                    f"WHERE {PK_FIELD_NAME} IN ({placeholders})",
+                    chunk,
+                ).rowcount
+
+            if deleted != len(unique_keys):
+                raise KeyError(
+                    "Trying to delete objects with keys, some of which do not exist"
                 )
 
     def delete(self, primary_key: int) -> None:
-        with closing(sqlite3.connect(self._db_name)) as con, con as con, closing(
-            con.cursor()
-        ) as cursor:
-            self._set_pragmas(cursor)
+        with self._pool.checkout() as con:
+            cursor = con.execute(self._sql_delete, (primary_key,))
 
-            cursor.execute(
-                f"DELETE FROM {self._table_name} WHERE {PK_FIELD_NAME}={primary_key}"
+        if cursor.rowcount == 0:
+            raise KeyError(
+                f"Trying to delete object with key {primary_key}, "
+                "which does not exist"
             )
-
-            if con.total_changes == 0:
-                raise KeyError(
-                    f"Trying to delete object with key {primary_key}, "
-                    "which does not exist"
-                )
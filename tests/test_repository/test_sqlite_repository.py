@@ -1,4 +1,7 @@
 import pytest
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
 
@@ -26,7 +29,34 @@ def db_name(tmp_path):
 
 @pytest.fixture
 def repo(custom_class, db_name):
-    return SqliteRepository(db_name, custom_class)
+    repo = SqliteRepository(db_name, custom_class)
+    yield repo
+    repo.close()
+
+
+def test_pragmas(db_name, repo):
+    with closing(sqlite3.connect(db_name)) as con:
+        assert con.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_incompatible_schema(db_name, custom_class):
+    with closing(sqlite3.connect(db_name)) as con:
+        con.execute("CREATE TABLE custom (primary_key INTEGER PRIMARY KEY, data TEXT)")
+    with pytest.raises(TypeError):
+        SqliteRepository(db_name, custom_class)
+
+
+def test_table_with_extra_column(db_name, custom_class):
+    with closing(sqlite3.connect(db_name)) as con:
+        con.execute(
+            "CREATE TABLE custom (primary_key INTEGER PRIMARY KEY NOT NULL, "
+            "data INTEGER, extra TEXT, data_str TEXT, data_float REAL, "
+            "data_date DATETIME)"
+        )
+    repo = SqliteRepository(db_name, custom_class)
+    obj = custom_class(data=1)
+    assert repo.get(repo.add(obj)) == obj
+    repo.close()
 
 
 def test_crud(repo, custom_class):
@@ -59,12 +89,151 @@ def test_cannot_delete_unexistent(repo):
         repo.delete(1)
 
 
+def test_cannot_delete_unexistent_after_changes(repo, custom_class):
+    primary_key = repo.add(custom_class())
+    repo.delete(primary_key)
+    with pytest.raises(KeyError):
+        repo.delete(primary_key)
+
+
 def test_cannot_update_without_pk(repo, custom_class):
     obj = custom_class()
     with pytest.raises(ValueError):
         repo.update(obj)
 
 
+def test_add_many(repo, custom_class):
+    repo.add(custom_class())
+    objects = [custom_class(data=i) for i in range(5)]
+    primary_keys = repo.add_many(objects)
+    assert primary_keys == [obj.primary_key for obj in objects]
+    assert [repo.get(pk) for pk in primary_keys] == objects
+    assert repo.add_many([]) == []
+
+
+def test_cannot_add_many_with_pk(repo, custom_class):
+    objects = [custom_class(), custom_class(primary_key=1)]
+    with pytest.raises(ValueError):
+        repo.add_many(objects)
+    assert repo.get_all() == []
+
+
+def test_cannot_update_unexistent(repo, custom_class):
+    repo.add(custom_class())
+    with pytest.raises(ValueError):
+        repo.update(custom_class(primary_key=2))
+
+
+def test_datetime_roundtrip(repo, custom_class):
+    dates = [
+        datetime(1969, 12, 31, 23, 59, 59, 999999),
+        datetime(2023, 3, 26, 2, 30, 0, 1),
+        datetime(9999, 12, 31, 23, 59, 59, 999999),
+    ]
+    for date in dates:
+        obj = custom_class(data_date=date)
+        assert repo.get(repo.add(obj)).data_date == date
+
+
+def test_legacy_datetime_format(db_name, custom_class):
+    with closing(sqlite3.connect(db_name)) as con, con:
+        con.execute(
+            "CREATE TABLE custom (primary_key INTEGER PRIMARY KEY NOT NULL, "
+            "data INTEGER, data_str TEXT, data_float REAL, data_date DATETIME)"
+        )
+        con.execute(
+            "INSERT INTO custom (data, data_str, data_float, data_date) "
+            "VALUES (1, 'test', 1.5, '15/10/26 09:10:52.000123')"
+        )
+
+    repo = SqliteRepository(db_name, custom_class)
+    obj = repo.get(1)
+    assert obj.data_date == datetime(2026, 10, 15, 9, 10, 52, 123)
+    repo.update(obj)
+    assert repo.get(1) == obj
+    repo.close()
+
+
+def test_indexed_fields(db_name, custom_class):
+    repo = SqliteRepository(db_name, custom_class, indexed_fields=["data"])
+    objects = [custom_class(data=i % 2) for i in range(4)]
+    for o in objects:
+        repo.add(o)
+    assert repo.get_all({"data": 1}) == objects[1::2]
+    repo.close()
+
+    with closing(sqlite3.connect(db_name)) as con:
+        plan = con.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM custom WHERE data = 1"
+        ).fetchall()
+    assert "idx_custom_data" in str(plan)
+
+
+def test_cannot_index_unexpected_field(db_name, custom_class):
+    with pytest.raises(ValueError):
+        SqliteRepository(db_name, custom_class, indexed_fields=["unknown"])
+
+
+def test_dataclass_without_defaults(db_name):
+    @dataclass
+    class Named:
+        name: str
+        primary_key: int = 0
+
+    repo = SqliteRepository(db_name, Named)
+    obj = Named("test")
+    assert repo.get(repo.add(obj)) == obj
+    repo.close()
+
+
+def test_plain_class(db_name):
+    class Plain:
+        primary_key: int = 0
+        data: int = 0
+
+    repo = SqliteRepository(db_name, Plain)
+    obj = Plain()
+    obj.data = 42
+    got = repo.get(repo.add(obj))
+    assert isinstance(got, Plain)
+    assert (got.primary_key, got.data) == (obj.primary_key, 42)
+    repo.close()
+
+
+def test_get_many(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(5)]
+    repo.add_many(objects)
+    keys = [objects[3].primary_key, 100, objects[0].primary_key]
+    assert repo.get_many(keys) == [objects[3], objects[0]]
+    assert repo.get_many([]) == []
+
+
+def test_get_many_duplicates(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(2)]
+    first, second = repo.add_many(objects)
+    assert repo.get_many([second, first, second]) == [objects[1], objects[0]]
+
+
+def test_get_many_large(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(2500)]
+    keys = repo.add_many(objects)
+    assert repo.get_many(keys) == objects
+
+
+def test_delete_many(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(5)]
+    keys = repo.add_many(objects)
+    repo.delete_many(keys[1:4])
+    assert repo.get_all() == [objects[0], objects[4]]
+
+
+def test_cannot_delete_many_unexistent(repo, custom_class):
+    keys = repo.add_many([custom_class() for i in range(3)])
+    with pytest.raises(KeyError):
+        repo.delete_many([*keys, 100])
+    assert len(repo.get_all()) == 3
+
+
 def test_get_all(repo, custom_class):
     objects = [custom_class() for i in range(5)]
     for o in objects:
@@ -86,3 +255,182 @@ def test_get_all_with_condition(repo, custom_class):
     assert repo.get_all({"data": 2}) == [objects[1]]
     assert repo.get_all({"data": -1}) == []
     assert repo.get_all({"data_str": "test"}) == objects
+    assert repo.get_all({"data_str": "test", "data": 3}) == [objects[2]]
+    assert repo.get_all({"data": 4, "data_str": "test"}) == [objects[3]]
+    assert repo.get_all({}) == objects
+
+
+def test_cannot_get_all_with_unexpected_field(repo):
+    with pytest.raises(ValueError):
+        repo.get_all({"unknown": 1})
+
+
+def test_concurrent_access(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(20)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        keys = list(executor.map(repo.add, objects))
+        got = list(executor.map(repo.get, keys))
+    assert got == objects
+
+
+def test_invalid_pool_size(db_name, custom_class):
+    with pytest.raises(ValueError):
+        SqliteRepository(db_name, custom_class, pool_size=0)
+
+
+def test_invalid_pool_size_for_shared_pool(repo, db_name):
+    with pytest.raises(ValueError):
+        SqliteRepository(db_name, Other, pool_size=0)
+
+
+def test_iter_all(repo, custom_class):
+    objects = [custom_class(data=i % 2) for i in range(2500)]
+    repo.add_many(objects)
+    assert list(repo.iter_all()) == objects
+    assert list(repo.iter_all({"data": 1})) == objects[1::2]
+
+
+@pytest.mark.parametrize("db_filename", [":memory:", None])
+def test_iter_all_and_update(db_filename, db_name, custom_class):
+    repo = SqliteRepository(db_filename or db_name, custom_class, pool_size=1)
+    repo.add_many([custom_class(data=i) for i in range(5)])
+    for obj in repo.iter_all():
+        obj.data += 10
+        repo.update(obj)
+    assert repo.get_column("data") == list(range(10, 15))
+    repo.close()
+
+
+def test_checkout_outlives_first_holder(repo, custom_class):
+    repo.add_many([custom_class(data=i) for i in range(3)])
+    idle = repo._pool._idle
+
+    it = repo.iter_all()
+    next(it)
+    with repo.transaction():
+        repo.add(custom_class())
+        list(it)
+        assert idle.empty()
+    assert not idle.empty()
+
+    first, second = repo.iter_all(), repo.iter_all()
+    next(first)
+    next(second)
+    list(first)
+    assert idle.empty()
+    assert len(list(second)) == 3
+    assert not idle.empty()
+
+
+def test_iter_all_validates_eagerly(repo):
+    with pytest.raises(ValueError):
+        repo.iter_all({"unknown": 1})
+
+
+def test_get_column(repo, custom_class):
+    objects = [custom_class(data=i, data_str=str(i % 2)) for i in range(5)]
+    repo.add_many(objects)
+    assert repo.get_column("data") == list(range(5))
+    assert repo.get_column("data_date", {"data_str": "1"}) == [
+        objects[1].data_date,
+        objects[3].data_date,
+    ]
+    assert repo.get_column("primary_key") == [o.primary_key for o in objects]
+
+
+def test_cannot_get_unexpected_column(repo):
+    with pytest.raises(ValueError):
+        repo.get_column("unknown")
+
+
+def test_transaction(repo, custom_class):
+    objects = [custom_class(data=i) for i in range(3)]
+    with repo.transaction():
+        for o in objects:
+            repo.add(o)
+        with repo.transaction():
+            repo.delete(objects[0].primary_key)
+        assert repo.get_all() == objects[1:]
+    assert repo.get_all() == objects[1:]
+
+
+def test_transaction_rollback(repo, custom_class):
+    obj = custom_class()
+    repo.add(obj)
+    with pytest.raises(KeyError):
+        with repo.transaction():
+            repo.add(custom_class())
+            repo.update(custom_class(primary_key=obj.primary_key, data=1))
+            repo.delete(100)
+    assert repo.get_all() == [obj]
+
+
+@dataclass
+class Other:
+    primary_key: int = 0
+    name: str = ""
+
+
+def test_transaction_across_repositories(repo, db_name, custom_class):
+    other_repo = SqliteRepository(db_name, Other)
+    with repo.transaction():
+        repo.add(custom_class())
+        other_repo.add(Other(name="test"))
+    assert other_repo.get_column("name") == ["test"]
+
+    with pytest.raises(KeyError):
+        with other_repo.transaction():
+            other_repo.add(Other())
+            repo.add(custom_class())
+            repo.delete(100)
+    assert len(repo.get_all()) == 1
+    assert len(other_repo.get_all()) == 1
+    other_repo.close()
+    assert len(repo.get_all()) == 1
+
+
+def test_nested_transaction_rollback(repo, custom_class):
+    keys = repo.add_many([custom_class(data=i) for i in range(3)])
+    with repo.transaction():
+        with pytest.raises(KeyError):
+            repo.delete_many([keys[0], 100])
+        with pytest.raises(ValueError):
+            repo.add_many([custom_class(), custom_class(primary_key=1)])
+        repo.delete(keys[1])
+    assert repo.get_column("primary_key") == [keys[0], keys[2]]
+
+
+def test_failed_commit_rolls_back(db_name, custom_class):
+    with closing(sqlite3.connect(db_name)) as con:
+        con.executescript(
+            "CREATE TABLE parent (primary_key INTEGER PRIMARY KEY);"
+            "CREATE TABLE custom (primary_key INTEGER PRIMARY KEY NOT NULL, "
+            "data INTEGER, data_str TEXT, data_float REAL, data_date DATETIME, "
+            "ref INTEGER REFERENCES parent DEFERRABLE INITIALLY DEFERRED)"
+        )
+    repo = SqliteRepository(db_name, custom_class)
+    with pytest.raises(sqlite3.IntegrityError):
+        with repo.transaction():
+            repo.add(custom_class())
+            with repo._pool.checkout() as con:
+                con.execute("INSERT INTO custom (ref) VALUES (1)")
+    with repo._pool.checkout() as con:
+        assert not con.in_transaction
+    assert repo.get_all() == []
+    repo.close()
+
+
+def test_connection_returned_without_transaction(repo):
+    with repo._pool.checkout() as con:
+        con.execute("BEGIN")
+    with repo._pool.checkout() as con:
+        assert not con.in_transaction
+
+
+def test_create_repository_inside_transaction(repo, db_name, custom_class):
+    with pytest.raises(RuntimeError):
+        with repo.transaction():
+            repo.add(custom_class())
+            SqliteRepository(db_name, Other, indexed_fields=["name"]).close()
+            raise RuntimeError
+    assert repo.get_all() == []